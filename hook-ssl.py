@@ -4,48 +4,171 @@ This hook dynamically finds the OpenSSL libraries that _ssl depends on.
 """
 from PyInstaller.utils.hooks import get_module_file_attribute
 from PyInstaller.compat import is_darwin, is_linux
-import subprocess
+import ctypes
 import os
+import struct
 
 # Initialize all hook variables at module level (required by PyInstaller)
 binaries = []
 datas = []
 hiddenimports = []
 
+# Mach-O constants (see <mach-o/loader.h> and <mach-o/fat.h>)
+FAT_MAGIC = 0xcafebabe
+MH_MAGIC = 0xfeedface
+MH_MAGIC_64 = 0xfeedfacf
+LC_LOAD_DYLIB = 0xc
+LC_LOAD_WEAK_DYLIB = 0x80000018
+LC_REEXPORT_DYLIB = 0x8000001f
+
+# ELF constants (see <elf.h>)
+ELFCLASS64 = 2
+PT_LOAD = 1
+PT_DYNAMIC = 2
+DT_NULL = 0
+DT_NEEDED = 1
+DT_STRTAB = 5
+
+
+def is_openssl_library(path):
+    name = os.path.basename(path)
+    return 'libssl' in name or 'libcrypto' in name
+
+
+def macho_dylibs(path):
+    """
+    Return the install names of the dylibs a Mach-O binary links against,
+    i.e. what `otool -L` prints. For universal binaries the first slice is used.
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    offset = 0
+    if struct.unpack_from('>I', data)[0] == FAT_MAGIC:
+        # fat_header is big-endian; the first fat_arch gives the slice offset
+        offset = struct.unpack_from('>I', data, 16)[0]
+
+    magic = struct.unpack_from('<I', data, offset)[0]
+    if magic not in (MH_MAGIC, MH_MAGIC_64):
+        raise ValueError(f"{path} is not a little-endian Mach-O binary")
+    ncmds = struct.unpack_from('<I', data, offset + 16)[0]
+    cmd_offset = offset + (32 if magic == MH_MAGIC_64 else 28)
+
+    dylibs = []
+    for _ in range(ncmds):
+        cmd, cmdsize = struct.unpack_from('<II', data, cmd_offset)
+        if cmd in (LC_LOAD_DYLIB, LC_LOAD_WEAK_DYLIB, LC_REEXPORT_DYLIB):
+            # dylib_command stores the offset of the NUL-terminated name
+            name_offset = struct.unpack_from('<I', data, cmd_offset + 8)[0]
+            name = data[cmd_offset + name_offset:cmd_offset + cmdsize].split(b'\0', 1)[0]
+            dylibs.append(name.decode('utf-8'))
+        cmd_offset += cmdsize
+    return dylibs
+
+
+def elf_needed(path):
+    """
+    Return the DT_NEEDED sonames of a little-endian ELF shared object.
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    if data[:4] != b'\x7fELF':
+        raise ValueError(f"{path} is not an ELF binary")
+    if data[4] == ELFCLASS64:
+        phoff, = struct.unpack_from('<Q', data, 0x20)
+        phentsize, phnum = struct.unpack_from('<HH', data, 0x36)
+        # p_type, p_offset, p_vaddr, p_filesz
+        read_phdr = lambda o: struct.unpack_from('<I4xQQ8xQ', data, o)
+        dyn_format = '<qQ'
+    else:
+        phoff, = struct.unpack_from('<I', data, 0x1c)
+        phentsize, phnum = struct.unpack_from('<HH', data, 0x2a)
+        read_phdr = lambda o: struct.unpack_from('<III4xI', data, o)
+        dyn_format = '<iI'
+
+    loads = []
+    dynamic = None
+    for i in range(phnum):
+        p_type, p_offset, p_vaddr, p_filesz = read_phdr(phoff + i * phentsize)
+        if p_type == PT_LOAD:
+            loads.append((p_vaddr, p_offset, p_filesz))
+        elif p_type == PT_DYNAMIC:
+            dynamic = (p_offset, p_filesz)
+    if dynamic is None:
+        return []
+
+    needed = []
+    strtab = None
+    entry_size = struct.calcsize(dyn_format)
+    for o in range(dynamic[0], dynamic[0] + dynamic[1], entry_size):
+        tag, value = struct.unpack_from(dyn_format, data, o)
+        if tag == DT_NULL:
+            break
+        if tag == DT_NEEDED:
+            needed.append(value)
+        elif tag == DT_STRTAB:
+            # DT_STRTAB is a virtual address; map it back to a file offset
+            strtab = next(offset + value - vaddr for vaddr, offset, size in loads if vaddr <= value < vaddr + size)
+    return [data[strtab + n:data.index(b'\0', strtab + n)].decode('utf-8') for n in needed]
+
+
+def resolve_needed(path):
+    """
+    Load a shared object and map its DT_NEEDED sonames to paths, i.e. what
+    `ldd` prints, using the mappings in /proc/self/maps. Sonames that could
+    not be resolved are left out.
+    """
+    needed = set(elf_needed(path))
+    ctypes.CDLL(path, mode=os.RTLD_LAZY)
+    mapped = set()
+    with open('/proc/self/maps') as maps:
+        for line in maps:
+            # Format: "address perms offset dev inode pathname"
+            parts = line.split(None, 5)
+            if len(parts) == 6 and parts[5].startswith('/'):
+                mapped.add(os.path.realpath(parts[5].strip()))
+
+    # The maps show symlink targets (libssl.so.3.0.x), not the sonames the
+    # loader looked up (libssl.so.3), so match a soname by what it resolves to
+    # next to each mapped file
+    resolved = {}
+    for lib_path in mapped:
+        for soname in needed:
+            candidate = os.path.join(os.path.dirname(lib_path), soname)
+            if os.path.realpath(candidate) == lib_path:
+                resolved[soname] = candidate
+    return resolved
+
+
 # Find the _ssl module
 ssl_file = get_module_file_attribute('_ssl')
 
 if ssl_file and os.path.exists(ssl_file):
     if is_darwin:
-        # Use otool on macOS to find OpenSSL dependencies
+        # Read the LC_LOAD_DYLIB commands from the Mach-O header
         try:
-            result = subprocess.run(['otool', '-L', ssl_file],
-                                  capture_output=True, text=True, check=True)
-            for line in result.stdout.split('\n'):
-                if 'libssl' in line or 'libcrypto' in line:
-                    # Extract the library path (first column after tab)
-                    lib_path = line.strip().split()[0]
-                    if os.path.exists(lib_path):
-                        # Add the library with its basename as destination
-                        binaries.append((lib_path, '.'))
-                        print(f"hook-ssl: Adding OpenSSL library: {lib_path}")
+            for lib_path in macho_dylibs(ssl_file):
+                if is_openssl_library(lib_path) and os.path.exists(lib_path):
+                    # Add the library with its basename as destination
+                    binaries.append((lib_path, '.'))
+                    print(f"hook-ssl: Adding OpenSSL library: {lib_path}")
         except Exception as e:
             print(f"hook-ssl WARNING: Could not determine OpenSSL dependencies: {e}")
 
     elif is_linux:
-        # Use ldd on Linux to find OpenSSL dependencies
+        # Read DT_NEEDED from the ELF header and let the loader resolve the paths
         try:
-            result = subprocess.run(['ldd', ssl_file],
-                                  capture_output=True, text=True, check=True)
-            for line in result.stdout.split('\n'):
-                if 'libssl' in line or 'libcrypto' in line:
-                    # Extract the library path (format: "libssl.so.3 => /path/to/lib (0x...)")
-                    parts = line.split('=>')
-                    if len(parts) > 1:
-                        lib_path = parts[1].strip().split()[0]
-                        if os.path.exists(lib_path):
-                            binaries.append((lib_path, '.'))
-                            print(f"hook-ssl: Adding OpenSSL library: {lib_path}")
+            resolved = resolve_needed(ssl_file)
+            for soname in elf_needed(ssl_file):
+                if not is_openssl_library(soname):
+                    continue
+                lib_path = resolved.get(soname)
+                if lib_path is None:
+                    print(f"hook-ssl WARNING: Could not resolve OpenSSL dependency: {soname}")
+                    continue
+                binaries.append((lib_path, '.'))
+                print(f"hook-ssl: Adding OpenSSL library: {lib_path}")
         except Exception as e:
             print(f"hook-ssl WARNING: Could not determine OpenSSL dependencies: {e}")
 
@@ -103,6 +103,10 @@ def detect_qr_code(image):
     processed_height, processed_width = processed_image.shape[:2]
 
     qr_codes = decode(processed_image)
+
+    # Scale factors back to the original image size are the same for every code
+    scale_x = original_width / processed_width
+    scale_y = original_height / processed_height
     
     for qr_code in qr_codes:
         qr_data = qr_code.data.decode('utf-8')
@@ -111,8 +115,6 @@ def detect_qr_code(image):
         # Draw a rectangle around the QR code
         (x, y, w, h) = qr_code.rect
         # Scale bounding box to original image size
-        scale_x = original_width / processed_width
-        scale_y = original_height / processed_height
         x = int(x * scale_x)
         y = int(y * scale_y)
         w = int(w * scale_x)
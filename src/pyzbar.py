@@ -1,4 +1,6 @@
-from typing import ClassVar, Mapping, Optional, Any, List, cast
+import asyncio
+import threading
+from typing import ClassVar, Mapping, Optional, Any, List, Tuple, Union, cast
 from typing_extensions import Self
 
 from PIL import Image
@@ -18,20 +20,106 @@ from viam.proto.service.vision import GetPropertiesResponse
 from viam.components.camera import Camera, ViamImage
 from viam.logging import getLogger
 from viam.media.utils.pil import viam_to_pil_image
+from viam.media.video import CameraMimeType
+from viam.media.viam_rgba import RGBA_HEADER_LENGTH
 
 import numpy as np
 import cv2
-from pyzbar.pyzbar import decode
+from pyzbar.pyzbar import decode, ZBarSymbol
 
 LOGGER = getLogger(__name__)
 
+# Adaptive threshold parameters for preprocess_image. The window grows with
+# the frame's shorter side so it stays wider than the finder pattern cores of
+# close-up codes; a narrower window turns those cores hollow.
+THRESHOLD_MIN_BLOCK_SIZE = 31
+THRESHOLD_BLOCK_DIVISOR = 4
+THRESHOLD_C = 5
+
+# Only QR codes are decoded, so zbar skips its 1-D barcode scan passes
+QR_SYMBOLS = [ZBarSymbol.QRCODE]
+
+# Frames are screened for QR finder patterns at this width before full detection;
+# codes narrower than about 4% of it are too small to screen reliably
+PRESCREEN_WIDTH = 640
+# Fraction by which the screened region is grown on each side before decoding
+PRESCREEN_MARGIN = 0.2
+
+
+def _find_qr_roi(image: np.ndarray) -> Optional[Tuple[int, int, int, int]]:
+    """
+    Cheaply look for QR finder patterns on a downscaled copy of the image.
+    Returns the (x0, y0, x1, y1) region that may contain codes, or None when
+    the frame has no group of three similar near-square shapes.
+    """
+    h, w = image.shape[:2]
+    scale = PRESCREEN_WIDTH / w
+    if scale >= 1:
+        # Too small for screening to save anything
+        return (0, 0, w, h)
+
+    small = cv2.resize(image, (PRESCREEN_WIDTH, max(round(h * scale), 1)), interpolation=cv2.INTER_AREA)
+    if small.ndim == 3:
+        small = cv2.cvtColor(small, cv2.COLOR_RGB2GRAY)
+    # Inverted so the dark finder rings and cores become contours
+    binary = cv2.adaptiveThreshold(small, 255, cv2.ADAPTIVE_THRESH_MEAN_C, cv2.THRESH_BINARY_INV, 11, 5)
+    contours, _ = cv2.findContours(binary, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
+
+    squares = []
+    for contour in contours:
+        x, y, cw, ch = cv2.boundingRect(contour)
+        if cw < 3 or ch < 3 or not 0.7 <= cw / ch <= 1.3:
+            continue
+        # Finder patterns fill most of their bounding box; this drops outlines of thin shapes
+        if cv2.contourArea(contour) < 0.5 * cw * ch:
+            continue
+        squares.append((x, y, x + cw, y + ch))
+    if len(squares) < 3:
+        return None
+
+    # Every QR code has three finder patterns of about the same size. Partners
+    # must be at least a pattern apart so the inner and outer contours of one
+    # ring don't count twice.
+    boxes = np.array(squares, dtype=np.float32)
+    sizes = boxes[:, 2] - boxes[:, 0]
+    centers = (boxes[:, :2] + boxes[:, 2:]) / 2
+    ratio = sizes[:, None] / sizes[None, :]
+    distance = np.abs(centers[:, None, :] - centers[None, :, :]).max(axis=2)
+    partners = (ratio >= 2 / 3) & (ratio <= 1.5) & (distance >= sizes[:, None])
+    similar = partners.sum(axis=1) >= 2
+    if not similar.any():
+        return None
+
+    # Grow the region around the candidate patterns and map it back to full
+    # resolution. A code reaches up to two pattern widths past any of its finder
+    # patterns, so the region covers that even when only one row was found.
+    x0, y0 = boxes[similar, :2].min(axis=0)
+    x1, y1 = boxes[similar, 2:].max(axis=0)
+    reach = 2 * sizes[similar].max()
+    pad_x = max((x1 - x0) * PRESCREEN_MARGIN, reach)
+    pad_y = max((y1 - y0) * PRESCREEN_MARGIN, reach)
+    return (
+        max(int((x0 - pad_x) / scale), 0),
+        max(int((y0 - pad_y) / scale), 0),
+        min(int((x1 + pad_x) / scale) + 1, w),
+        min(int((y1 + pad_y) / scale) + 1, h),
+    )
+
+
 class pyzbar(Vision, Reconfigurable):
     """
-    Custom Vision Service that uses pyzbar to detect QR codes.
+    Custom Vision Service that uses OpenCV and pyzbar to detect QR codes.
     """
 
     MODEL: ClassVar[Model] = Model(ModelFamily("joyce", "vision"), "pyzbar")
 
+    def __init__(self, name: str, **kwargs):
+        super().__init__(name, **kwargs)
+        # Detection runs in worker threads, so the reusable detector and
+        # preprocessing buffers live in thread-local state (see _thread_state)
+        self._local = threading.local()
+        self.prescreen = False
+
     # Constructor
     @classmethod
     def new(cls, config: ComponentConfig, dependencies: Mapping[ResourceName, ResourceBase]) -> Self:
@@ -43,6 +131,10 @@ class pyzbar(Vision, Reconfigurable):
     @classmethod
     def validate(cls, config: ComponentConfig):
         # Declare camera as a required dependency based on attributes
+        prescreen = config.attributes.fields.get("prescreen")
+        if prescreen is not None and prescreen.WhichOneof("kind") != "bool_value":
+            raise ValueError("Attribute 'prescreen' must be a boolean")
+
         camera_name = config.attributes.fields.get("camera_name")
         if camera_name:
             camera_name_str = camera_name.string_value or camera_name.list_value
@@ -54,25 +146,30 @@ class pyzbar(Vision, Reconfigurable):
     # Handles attribute reconfiguration
     def reconfigure(self, config: ComponentConfig, dependencies: Mapping[ResourceName, ResourceBase]):
         self.DEPS = dependencies
+        # Index dependencies by name so per-frame camera lookups are a single dict hit
+        self._deps_by_name = {rn.name: r for rn, r in dependencies.items()}
+        # The camera may change resolution, so drop buffers sized for the old one
+        self._local = threading.local()
+
+        # Skipping frames without finder patterns is opt-in, since codes that are
+        # very small in the frame can't be screened for
+        prescreen = config.attributes.fields.get("prescreen")
+        self.prescreen = prescreen.bool_value if prescreen is not None else False
 
         # Log available dependencies for debugging
         dep_names = [rn.name for rn in dependencies.keys()]
         LOGGER.info(f"Reconfiguring with dependencies: {dep_names}")
         return
         
-    async def get_cam_image(self, camera_name: str) -> ViamImage:
-        # Find the camera in dependencies by iterating and matching name
-        actual_cam = None
-        for resource_name, resource in self.DEPS.items():
-            if resource_name.name == camera_name:
-                actual_cam = resource
-                break
-
+    async def get_cam_image(self, camera_name: str, mime_type: str = CameraMimeType.VIAM_RGBA) -> ViamImage:
+        # Find the camera in dependencies by name
+        actual_cam = self._deps_by_name.get(camera_name)
         if actual_cam is None:
-            raise ValueError(f"Camera '{camera_name}' not found in dependencies. Available: {[rn.name for rn in self.DEPS.keys()]}")
+            raise ValueError(f"Camera '{camera_name}' not found in dependencies. Available: {list(self._deps_by_name)}")
 
         cam = cast(Camera, actual_cam)
-        cam_image = await cam.get_image(mime_type="image/jpeg")
+        # Raw RGBA by default so frames used for detection skip a JPEG encode/decode
+        cam_image = await cam.get_image(mime_type=mime_type)
         return cam_image
 
     async def get_detections_from_camera(self, camera_name: str, *, extra: Optional[Mapping[str, Any]] = None, timeout: Optional[float] = None) -> List[Detection]:
@@ -87,15 +184,9 @@ class pyzbar(Vision, Reconfigurable):
         extra: Optional[Mapping[str, Any]] = None,
         timeout: Optional[float] = None,
     ) -> List[Detection]:
-        # Convert PIL image to OpenCV format
-        image_cv = np.array(image)
-        image_cv = cv2.cvtColor(image_cv, cv2.COLOR_RGB2BGR)
-
-        # Encode as JPEG to create proper ViamImage
-        _, encoded = cv2.imencode('.jpg', image_cv)
-        viam_image = ViamImage(data=encoded.tobytes(), mime_type="image/jpeg")
-
-        return await self.detect_qr_code(viam_image)
+        # Hand the pixels straight to the detector; pyzbar only needs grayscale,
+        # so there is no need to round-trip through a JPEG ViamImage
+        return await asyncio.to_thread(self._detect_sync, image)
 
     async def get_classifications(
         self,
@@ -113,44 +204,168 @@ class pyzbar(Vision, Reconfigurable):
 
     async def detect_qr_code(self, image: ViamImage) -> List[Detection]:
         """
-        Detect QR codes in the given image using pyzbar.
+        Detect QR codes in the given image using OpenCV, falling back to pyzbar.
         """
-        # Convert ViamImage to OpenCV format
-        image_pil = viam_to_pil_image(image)
-        image_cv = np.array(image_pil)
-        image_cv = cv2.cvtColor(image_cv, cv2.COLOR_RGB2BGR)
-        
-        # Detect QR codes
-        processed_image = self.preprocess_image(image_cv)
-        qr_codes = decode(processed_image)
-        detections = []
-        
-        for qr_code in qr_codes:
-            qr_data = qr_code.data.decode('utf-8')
-
-            # Create a Detection object for each QR code detected
-            (x, y, w, h) = qr_code.rect
-            # Adjust bounding box to align with original image dimensions
-            scale_x = image_cv.shape[1] / processed_image.shape[1]
-            scale_y = image_cv.shape[0] / processed_image.shape[0]
-            x = int(x * scale_x)
-            y = int(y * scale_y)
-            w = int(w * scale_x)
-            h = int(h * scale_y)
-            detection = Detection(x_min=x, y_min=y, x_max=x + w, y_max=y + h, class_name=qr_data, confidence=1.0)
-            detections.append(detection)
+        # Decoding and detection are native calls that release the GIL, so run
+        # them off the event loop to keep other requests moving
+        return await asyncio.to_thread(self._detect_sync, image)
 
+    def _detect_sync(self, image: Union[ViamImage, Image.Image]) -> List[Detection]:
+        """
+        Convert and run detection on an image; called from a worker thread.
+        """
+        if isinstance(image, Image.Image):
+            image_cv = self._pil_to_ndarray(image)
+        else:
+            image_cv = self._viam_to_ndarray(image)
+        return self._detect_from_ndarray(image_cv)
+
+    def _thread_state(self) -> threading.local:
+        """
+        Return this thread's QR detector and preprocessing buffers, creating them on first use.
+        """
+        state = self._local
+        if not hasattr(state, 'qr_detector'):
+            # OpenCV's detector is the primary decoder and pyzbar is the fallback
+            state.qr_detector = cv2.QRCodeDetector()
+            # Preprocessing buffers for the most recent frame shape, reused across frames
+            state.scratch_shape = None
+            state.scratch = {}
+        return state
+
+    @classmethod
+    def _viam_to_ndarray(cls, image: ViamImage) -> np.ndarray:
+        """
+        Convert a ViamImage to a numpy array, reading raw RGBA frames in place.
+        """
+        if image.mime_type == CameraMimeType.VIAM_RGBA:
+            # Raw frames are a fixed-size header followed by packed RGBA pixels;
+            # anything that doesn't add up is left to PIL to decode or reject
+            w, h = image.width, image.height
+            if w and h and len(image.data) == RGBA_HEADER_LENGTH + w * h * 4:
+                pixels = np.frombuffer(image.data, dtype=np.uint8, offset=RGBA_HEADER_LENGTH)
+                return pixels.reshape(h, w, 4)
+        if image.mime_type in (CameraMimeType.JPEG, CameraMimeType.PNG):
+            # Decode straight to grayscale; for JPEG this skips the chroma planes
+            # and the color conversion that preprocess_image would otherwise do.
+            # EXIF orientation is ignored, as PIL does, so boxes match the stored pixels.
+            gray = cv2.imdecode(np.frombuffer(image.data, np.uint8), cv2.IMREAD_GRAYSCALE | cv2.IMREAD_IGNORE_ORIENTATION)
+            if gray is not None:
+                return gray
+        return cls._pil_to_ndarray(viam_to_pil_image(image))
+
+    @staticmethod
+    def _pil_to_ndarray(image: Image.Image) -> np.ndarray:
+        """
+        Expose a PIL image's pixels as a read-only numpy array without the
+        extra copy np.array makes. Gray images stay single-channel.
+        """
+        if image.mode == 'L':
+            return np.frombuffer(image.tobytes(), dtype=np.uint8).reshape(image.height, image.width)
+        # Palette, 16-bit, CMYK etc. need converting before the pixels are usable
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGB')
+        return np.asarray(image)
+
+    def _detect_from_ndarray(self, image_cv: np.ndarray) -> List[Detection]:
+        """
+        Detect QR codes in an image that is already a numpy array.
+        """
+        h, w = image_cv.shape[:2]
+        full_frame = (0, 0, w, h)
+        roi = _find_qr_roi(image_cv) if self.prescreen else full_frame
+        if roi is None:
+            return []
+
+        gray_image = self._to_gray(image_cv)
+        detections = self._decode_region(gray_image, roi)
+        if not detections and roi != full_frame:
+            # The region can miss a code whose finder patterns weren't all found,
+            # so an empty result is confirmed on the whole frame
+            detections = self._decode_region(gray_image, full_frame)
         return detections
-    
+
+    def _decode_region(self, gray_image: np.ndarray, roi: Tuple[int, int, int, int]) -> List[Detection]:
+        """
+        Decode the QR codes inside the (x0, y0, x1, y1) region of a grayscale image.
+        """
+        x0, y0, x1, y1 = roi
+
+        # OpenCV locates and decodes every code in the frame in one native call.
+        # It binarizes internally, so it gets the gray image rather than the
+        # thresholded one, which it handles far worse.
+        ok, decoded_info, points, _ = self._thread_state().qr_detector.detectAndDecodeMulti(gray_image[y0:y1, x0:x1])
+        if ok:
+            # Codes that were located but could not be decoded come back empty
+            keep = [i for i, qr_data in enumerate(decoded_info) if qr_data]
+            if keep:
+                # Reduce every 4-point polygon to an axis-aligned box at once;
+                # corners extrapolated past the region edges are clamped to it
+                corners = points[keep].clip(0, (x1 - x0, y1 - y0))
+                boxes = np.concatenate([corners.min(axis=1), corners.max(axis=1)], axis=1).astype(np.int32)
+                return self._to_detections(boxes, [decoded_info[i] for i in keep], (x0, y0))
+
+        # Fall back to pyzbar on the thresholded image when OpenCV could not decode anything
+        processed_image = self.preprocess_image(gray_image)[y0:y1, x0:x1]
+        qr_codes = decode(processed_image, symbols=QR_SYMBOLS)
+        if not qr_codes:
+            return []
+
+        # Convert every (x, y, w, h) rect to (x_min, y_min, x_max, y_max) at once;
+        # the processed region is at native resolution, so no rescaling is needed
+        boxes = np.array([qr_code.rect for qr_code in qr_codes], dtype=np.int32)
+        boxes[:, 2:] += boxes[:, :2]
+        return self._to_detections(boxes, [qr_code.data.decode('utf-8') for qr_code in qr_codes], (x0, y0))
+
+    @staticmethod
+    def _to_detections(boxes: np.ndarray, labels: List[str], origin: Tuple[int, int]) -> List[Detection]:
+        """
+        Build Detection objects from an (N, 4) array of xyxy boxes and their decoded data,
+        translating the boxes from the decoded region back to frame coordinates.
+        """
+        boxes[:, 0::2] += origin[0]
+        boxes[:, 1::2] += origin[1]
+        return [
+            Detection(x_min=x_min, y_min=y_min, x_max=x_max, y_max=y_max, class_name=label, confidence=1.0)
+            for (x_min, y_min, x_max, y_max), label in zip(boxes.tolist(), labels)
+        ]
+
+    def _scratch(self, h: int, w: int) -> dict:
+        """
+        Return this thread's preprocessing buffers for an (h, w) frame.
+        Only one frame shape is kept per thread; a new shape replaces the buffers.
+        """
+        state = self._thread_state()
+        if state.scratch_shape != (h, w):
+            state.scratch_shape = (h, w)
+            state.scratch = {
+                'gray': np.empty((h, w), np.uint8),
+                'thresh': np.empty((h, w), np.uint8),
+            }
+        return state.scratch
+
+    def _to_gray(self, image: np.ndarray) -> np.ndarray:
+        """
+        Convert an RGB(A) image to grayscale in a scratch buffer.
+        Single-channel images ('L' mode, decoded JPEG/PNG) are returned as is.
+        """
+        if image.ndim == 2:
+            return image
+        h, w = image.shape[:2]
+        return cv2.cvtColor(image, cv2.COLOR_RGB2GRAY, dst=self._scratch(h, w)['gray'])
+
     def preprocess_image(self, image):
         """
         Preprocess the image to improve QR code detection.
+        The result is a scratch buffer that is overwritten by the next call
+        on the same thread.
         """
-        gray_image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-        equalized_image = cv2.equalizeHist(gray_image)
-        threshold_image = cv2.threshold(equalized_image, 128, 255, cv2.THRESH_BINARY)[1]
-        resized_image = cv2.resize(threshold_image, None, fx=1.5, fy=1.5, interpolation=cv2.INTER_LINEAR)
-        return resized_image
+        h, w = image.shape[:2]
+        gray_image = self._to_gray(image)
+        # A local threshold copes with uneven lighting without a separate
+        # histogram equalization pass, and zbar handles scale on its own
+        block_size = max(THRESHOLD_MIN_BLOCK_SIZE, (min(h, w) // THRESHOLD_BLOCK_DIVISOR) | 1)
+        return cv2.adaptiveThreshold(gray_image, 255, cv2.ADAPTIVE_THRESH_MEAN_C, cv2.THRESH_BINARY, block_size, THRESHOLD_C, dst=self._scratch(h, w)['thresh'])
 
     async def get_classifications_from_camera(self, camera_name: str, count: int, *, extra: Optional[Mapping[str, Any]] = None, timeout: Optional[float] = None) -> List[Classification]:
         """
@@ -168,7 +383,7 @@ class pyzbar(Vision, Reconfigurable):
         result = CaptureAllResult()
 
         if return_image:
-            result.image = await self.get_cam_image(camera_name)
+            result.image = await self.get_cam_image(camera_name, mime_type=CameraMimeType.JPEG)
 
         if return_detections:
             result.detections = await self.get_detections_from_camera(camera_name)
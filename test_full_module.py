@@ -4,6 +4,8 @@ This test is designed to expose import errors and runtime issues.
 """
 
 import asyncio
+import cv2
+import numpy as np
 from PIL import Image
 from viam.proto.app.robot import ComponentConfig
 from viam.proto.common import ResourceName
@@ -16,6 +18,11 @@ from typing import Mapping
 import src
 from src.pyzbar import pyzbar
 
+# A blank white frame is identical in any channel order, so encode it once
+_ok, _encoded = cv2.imencode('.jpg', np.full((480, 640, 3), 255, np.uint8))
+assert _ok, "Failed to encode the blank test frame"
+_BLANK_JPEG_BYTES = _encoded.tobytes()
+
 
 class MockCamera(Camera):
     """Mock camera for testing"""
@@ -25,17 +32,7 @@ class MockCamera(Camera):
 
     async def get_image(self, mime_type: str = "", *, extra=None, timeout=None) -> ViamImage:
         """Return a test image as ViamImage"""
-        # Create a simple test image
-        img = Image.new('RGB', (640, 480), color='white')
-
-        # Convert to ViamImage format
-        import cv2
-        import numpy as np
-        image_cv = np.array(img)
-        image_cv = cv2.cvtColor(image_cv, cv2.COLOR_RGB2BGR)
-        _, encoded = cv2.imencode('.jpg', image_cv)
-
-        return ViamImage(data=encoded.tobytes(), mime_type="image/jpeg")
+        return ViamImage(data=_BLANK_JPEG_BYTES, mime_type="image/jpeg")
 
     async def get_images(self, *, timeout=None):
         return []
@@ -3,9 +3,42 @@ Regression tests for pyzbar vision service.
 """
 
 import asyncio
+import io
+import sys
+import cv2
+import numpy as np
 from PIL import Image
-from src.pyzbar import pyzbar
+from pyzbar.pyzbar import decode
+from src.pyzbar import pyzbar, _find_qr_roi, QR_SYMBOLS
+from viam.components.camera import ViamImage
+from viam.media.video import CameraMimeType
 from viam.proto.app.robot import ComponentConfig
+from viam.utils import dict_to_struct
+
+
+def make_qr_frame(texts, size=200, frame_size=(640, 480), gap=20, origin=(40, 40)):
+    """
+    Render one QR code per entry of `texts` onto a white RGB frame, side by
+    side from `origin` with `gap` pixels between them.
+    """
+    encoder = cv2.QRCodeEncoder.create()
+    frame = np.full((frame_size[1], frame_size[0], 3), 255, np.uint8)
+    y = origin[1]
+    for i, text in enumerate(texts):
+        code = cv2.resize(encoder.encode(text), (size, size), interpolation=cv2.INTER_NEAREST)
+        x = origin[0] + i * (size + gap)
+        frame[y:y + size, x:x + size] = code[..., None]
+    return frame
+
+
+def make_rgba_image(frame):
+    """
+    Pack an RGB frame as a raw image/vnd.viam.rgba ViamImage (header + RGBA pixels).
+    """
+    h, w = frame.shape[:2]
+    pixels = np.dstack([frame, np.full((h, w), 255, np.uint8)])
+    data = b"RGBA" + w.to_bytes(4, "big") + h.to_bytes(4, "big") + pixels.tobytes()
+    return ViamImage(data, CameraMimeType.VIAM_RGBA)
 
 
 async def test_get_detections_with_pil_image():
@@ -33,6 +66,226 @@ async def test_get_detections_with_pil_image():
         print(f"  Detected QR codes: {[d.class_name for d in detections]}")
 
 
+async def test_get_detections_with_close_up_code():
+    """
+    Test that a QR code filling much of a high-resolution frame is detected
+    end to end, with its box inside the frame. pxl.jpg is a 3072x4080 photo
+    of a code encoding '1002'.
+    """
+
+    test_image = Image.open("pxl.jpg")
+    vision_service = pyzbar("test_qr")
+    detections = await vision_service.get_detections(test_image)
+
+    labels = [d.class_name for d in detections]
+    assert labels == ["1002"], f"Expected ['1002'], got {labels}"
+    for d in detections:
+        assert 0 <= d.x_min < d.x_max <= test_image.width, f"Box outside frame: {d}"
+        assert 0 <= d.y_min < d.y_max <= test_image.height, f"Box outside frame: {d}"
+    print(f"✓ PASS: close-up code decoded: {labels}")
+
+
+def test_preprocess_keeps_close_up_code_decodable():
+    """
+    Test that pyzbar can decode pxl.jpg after preprocess_image. The adaptive
+    threshold window has to be wider than the code's finder patterns, or their
+    dark cores come out hollow and the fallback decoder can't find the code.
+    """
+
+    gray = np.asarray(Image.open("pxl.jpg").convert("L"))
+    vision_service = pyzbar("test_qr")
+    qr_codes = decode(vision_service.preprocess_image(gray), symbols=QR_SYMBOLS)
+
+    labels = [qr_code.data.decode("utf-8") for qr_code in qr_codes]
+    assert labels == ["1002"], f"Expected ['1002'] after preprocessing, got {labels}"
+    print(f"✓ PASS: close-up code decodable after preprocessing: {labels}")
+
+
+async def test_detect_qr_code_with_rgba_image():
+    """
+    Test that raw RGBA camera frames are decoded with correct coordinates.
+    """
+
+    vision_service = pyzbar("test_qr")
+    detections = await vision_service.detect_qr_code(make_rgba_image(make_qr_frame(["RGBA"])))
+
+    labels = [d.class_name for d in detections]
+    assert labels == ["RGBA"], f"Expected ['RGBA'], got {labels}"
+    d = detections[0]
+    assert 30 <= d.x_min <= 70 and 30 <= d.y_min <= 70, f"Unexpected box: {d}"
+    assert 200 <= d.x_max <= 250 and 200 <= d.y_max <= 250, f"Unexpected box: {d}"
+    print(f"✓ PASS: RGBA frame decoded: {labels}")
+
+
+async def test_detect_qr_code_with_truncated_rgba_image():
+    """
+    Test that an RGBA frame whose payload doesn't match its header falls
+    back to PIL, which rejects it, instead of failing to reshape.
+    """
+
+    image = make_rgba_image(make_qr_frame(["RGBA"]))
+    truncated = ViamImage(image.data[:-1000], CameraMimeType.VIAM_RGBA)
+
+    vision_service = pyzbar("test_qr")
+    try:
+        await vision_service.detect_qr_code(truncated)
+    except OSError as e:
+        print(f"✓ PASS: truncated RGBA frame rejected by PIL: {e}")
+    else:
+        raise AssertionError("Expected PIL to reject the truncated RGBA frame")
+
+
+async def test_detect_qr_code_with_encoded_images():
+    """
+    Test that JPEG and PNG camera frames, which are decoded straight to
+    grayscale, are detected with correct coordinates. Frames tagged with an
+    EXIF orientation must not be rotated, so boxes match the stored pixels.
+    """
+
+    vision_service = pyzbar("test_qr")
+    # OpenCV encodes BGR, which doesn't matter for a black and white frame
+    frame = make_qr_frame(["ENCODED"])
+
+    cases = []
+    for extension, mime_type in ((".jpg", CameraMimeType.JPEG), (".png", CameraMimeType.PNG)):
+        ok, encoded = cv2.imencode(extension, frame)
+        assert ok, f"Failed to encode test frame as {extension}"
+        cases.append((extension, mime_type, encoded.tobytes()))
+
+    # Orientation 6 asks viewers to rotate the stored pixels 90 degrees clockwise
+    exif = Image.Exif()
+    exif[0x0112] = 6
+    for image_format, mime_type in (("JPEG", CameraMimeType.JPEG), ("PNG", CameraMimeType.PNG)):
+        buffer = io.BytesIO()
+        Image.fromarray(frame).save(buffer, image_format, exif=exif)
+        cases.append((f"{image_format} with EXIF orientation", mime_type, buffer.getvalue()))
+
+    for name, mime_type, data in cases:
+        detections = await vision_service.detect_qr_code(ViamImage(data, mime_type))
+
+        labels = [d.class_name for d in detections]
+        assert labels == ["ENCODED"], f"{name}: expected ['ENCODED'], got {labels}"
+        d = detections[0]
+        assert 30 <= d.x_min <= 70 and 30 <= d.y_min <= 70, f"{name}: unexpected box: {d}"
+        assert 200 <= d.x_max <= 250 and 200 <= d.y_max <= 250, f"{name}: unexpected box: {d}"
+        print(f"✓ PASS: {name} frame decoded: {labels}")
+
+
+class _NoCodeDetector:
+    """
+    Stands in for cv2.QRCodeDetector when it decodes nothing.
+    """
+
+    def detectAndDecodeMulti(self, image):
+        return False, (), None, None
+
+
+def test_pyzbar_fallback():
+    """
+    Test that codes OpenCV can't decode are detected by the pyzbar fallback,
+    with zbar's rects converted to frame coordinates from the screened region.
+    """
+
+    vision_service = pyzbar("test_qr")
+    vision_service.prescreen = True
+    # The detector is per thread, so decode on this thread rather than through to_thread
+    vision_service._thread_state().qr_detector = _NoCodeDetector()
+
+    module = sys.modules[pyzbar.__module__]
+    symbols_used = []
+
+    def recording_decode(image, symbols=None):
+        symbols_used.append(symbols)
+        return decode(image, symbols=symbols)
+
+    frame = make_qr_frame(["FALLBACK"], frame_size=(1280, 720), origin=(600, 300))
+    x0, y0, _, _ = _find_qr_roi(frame)
+    assert x0 > 0 and y0 > 0, "Expected the screened region to be offset from the frame origin"
+
+    module.decode = recording_decode
+    try:
+        detections = vision_service._detect_from_ndarray(frame)
+    finally:
+        module.decode = decode
+
+    labels = [d.class_name for d in detections]
+    assert labels == ["FALLBACK"], f"Expected ['FALLBACK'], got {labels}"
+    assert symbols_used and all(s == QR_SYMBOLS for s in symbols_used), f"pyzbar called with {symbols_used}"
+    d = detections[0]
+    assert 590 <= d.x_min <= 630 and 290 <= d.y_min <= 330, f"Unexpected box: {d}"
+    assert 760 <= d.x_max <= 810 and 460 <= d.y_max <= 510, f"Unexpected box: {d}"
+    print(f"✓ PASS: pyzbar fallback decoded: {labels} at ({d.x_min}, {d.y_min}, {d.x_max}, {d.y_max})")
+
+
+def test_find_qr_roi():
+    """
+    Test that the screened region covers every code in the frame and that
+    frames without finder patterns are skipped.
+    """
+
+    frame = make_qr_frame(["HELLO0", "HELLO1"], size=102, frame_size=(1280, 720))
+    roi = _find_qr_roi(frame)
+    assert roi is not None, "Expected a region for a frame with two codes"
+    x0, y0, x1, y1 = roi
+    # The codes span (40, 40) to (264, 142)
+    assert x0 <= 40 and y0 <= 40 and x1 >= 264 and y1 >= 142, f"Region {roi} crops the codes"
+
+    blank = np.full((720, 1280, 3), 255, np.uint8)
+    assert _find_qr_roi(blank) is None, "Expected no region for a blank frame"
+    print(f"✓ PASS: screened region {roi} covers both codes")
+
+
+async def test_prescreen_does_not_change_detections():
+    """
+    Test that prescreen is off by default and that turning it on detects the
+    same codes, including several codes side by side and small codes in a
+    large frame.
+    """
+
+    vision_service = pyzbar("test_qr")
+    assert vision_service.prescreen is False, "prescreen should default to off"
+
+    frames = [
+        make_qr_frame(["HELLO0", "HELLO1"], size=102, frame_size=(1280, 720)),
+        make_qr_frame(["SMALL0", "SMALL1"], size=96, frame_size=(1920, 1080)),
+        np.full((480, 640, 3), 255, np.uint8),
+    ]
+    for frame in frames:
+        results = {}
+        for prescreen in (False, True):
+            vision_service.prescreen = prescreen
+            detections = await vision_service.get_detections(Image.fromarray(frame))
+            results[prescreen] = sorted((d.class_name, d.x_min, d.y_min, d.x_max, d.y_max) for d in detections)
+        assert results[True] == results[False], f"prescreen changed detections: {results}"
+        print(f"✓ PASS: prescreen on/off agree: {[r[0] for r in results[True]]}")
+
+
+def test_validate_prescreen():
+    """
+    Test that validate() accepts a boolean prescreen and rejects anything else.
+    """
+
+    config = ComponentConfig(name="test_qr", attributes=dict_to_struct({"prescreen": True}))
+    assert pyzbar.validate(config) == []
+
+    config = ComponentConfig(name="test_qr", attributes=dict_to_struct({"prescreen": "true"}))
+    try:
+        pyzbar.validate(config)
+    except ValueError as e:
+        print(f"✓ PASS: non-boolean prescreen rejected: {e}")
+    else:
+        raise AssertionError("Expected validate() to reject a string prescreen")
+
+
 if __name__ == "__main__":
     asyncio.run(test_get_detections_with_pil_image())
+    asyncio.run(test_get_detections_with_close_up_code())
+    test_preprocess_keeps_close_up_code_decodable()
+    asyncio.run(test_detect_qr_code_with_rgba_image())
+    asyncio.run(test_detect_qr_code_with_truncated_rgba_image())
+    asyncio.run(test_detect_qr_code_with_encoded_images())
+    test_pyzbar_fallback()
+    test_find_qr_roi()
+    asyncio.run(test_prescreen_does_not_change_detections())
+    test_validate_prescreen()
     print("\nTest passed!")